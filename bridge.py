@@ -1,16 +1,37 @@
 #!/usr/bin/env python3
 import os
+import sys
 import time
+import signal
 import json
-import hmac
+import queue
+import functools
 import hashlib
-import secrets
+import traceback
 from urllib.parse import urlencode
 
-import requests
-import paho.mqtt.client as paho
+try:
+    import orjson  # optional fast path; not every add-on arch has a wheel
+except ImportError:
+    orjson = None
 
 # ---------- Minimal Tuya OpenAPI (v2 signature) ----------
+_EMPTY_SHA256 = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'  # SHA256(b'')
+_GET_EMPTY_PREFIX = f"GET\n{_EMPTY_SHA256}\n\n"  # stringToSign up to the path for body-less GETs
+
+@functools.lru_cache(maxsize=32)
+def _encode_qs(items):
+    # items is a sorted tuple of (key, str(value)) pairs, so repeated params hit the cache
+    return urlencode(items)
+
+def _hmac_sha256_states(key):
+    """Keyed inner/outer SHA-256 states for HMAC (RFC 2104); copy() and update() per message."""
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key.ljust(64, b'\0')
+    return (hashlib.sha256(bytes(b ^ 0x36 for b in key)),
+            hashlib.sha256(bytes(b ^ 0x5c for b in key)))
+
 class TuyaOpenAPI:
     """
     Tuya OpenAPI client using v2 signing:
@@ -19,11 +40,29 @@ class TuyaOpenAPI:
       sign         = HMAC-SHA256(ACCESS_KEY, message).hexdigest().upper()
     """
     def __init__(self, base_url, access_id, access_key, logger=None):
+        # Deferred: requests pulls in urllib3, idna and charset detection
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
         self.base_url = base_url.rstrip('/')
         self.access_id = access_id
         self.access_key = access_key
+        # Static credentials pre-encoded once for signing
+        self._access_id_b = access_id.encode('utf-8')
+        # HMAC-SHA256 keyed inner/outer states, copied per request
+        self._inner, self._outer = _hmac_sha256_states(access_key.encode('utf-8'))
         self.access_token = None
+        # Static header fields; per-request sign/t/nonce are added to a copy
+        self._hdr_tmpl = {'client_id': access_id, 'sign_method': 'HMAC-SHA256'}
+        self._hdr_tmpl_auth = self._hdr_tmpl
         self.log = logger or (lambda *a, **k: None)
+        # Keep the HTTPS connection to the Tuya host alive between polls and
+        # retry transient transport failures/5xx on GETs with exponential backoff
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                        allowed_methods=frozenset(['GET']), raise_on_status=False)
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retries))
 
     def connect(self):
         data = self._request('GET', '/v1.0/token', params={'grant_type': 1}, use_token=False)
@@ -31,67 +70,88 @@ class TuyaOpenAPI:
             tok = data.get('result', {}).get('access_token')
             if tok:
                 self.access_token = tok
+                self._hdr_tmpl_auth = {**self._hdr_tmpl, 'access_token': tok}
                 self.log(f"Tuya token obtained; expires in {data.get('result',{}).get('expire_time')}s.")
         return data
 
     def get(self, path, params=None):
         return self._request('GET', path, params=params, use_token=True)
 
-    def _request(self, method, path, params=None, body=None, use_token=True, retry=True):
+    def fetch_shadow(self, device_id):
+        """Fast path for the polled shadow read: fixed GET, no params, empty body."""
+        full_path = f"/v2.0/cloud/thing/{device_id}/shadow/properties"
+        return self._send_with_refresh(full_path, _GET_EMPTY_PREFIX + full_path, '', use_token=True)
+
+    def close(self):
+        self._session.close()
+
+    def _request(self, method, path, params=None, body=None, use_token=True):
         method = method.upper()
         if not path.startswith('/'):
             path = '/' + path
 
-        qs = urlencode(sorted([(k, str(v)) for k, v in (params or {}).items()])) if params else ''
+        items = tuple(sorted((k, str(v)) for k, v in (params or {}).items()))
+        qs = _encode_qs(items) if items else ''
         full_path = f"{path}?{qs}" if qs else path
 
-        body_str = '' if (method == 'GET' or body is None) else json.dumps(body, separators=(',', ':'), ensure_ascii=False)
-        content_sha256 = hashlib.sha256(body_str.encode('utf-8')).hexdigest()
+        if method == 'GET' or body is None:
+            body_str = ''
+        elif orjson is not None:
+            body_str = orjson.dumps(body).decode('utf-8')  # already compact UTF-8
+        else:
+            body_str = json.dumps(body, separators=(',', ':'), ensure_ascii=False)
+        content_sha256 = _EMPTY_SHA256 if not body_str else hashlib.sha256(body_str.encode('utf-8')).hexdigest()
 
         string_to_sign = f"{method}\n{content_sha256}\n\n{full_path}"
+        return self._send_with_refresh(full_path, string_to_sign, body_str, use_token)
 
-        t = str(int(time.time() * 1000))
-        nonce = secrets.token_hex(16)
+    def _send_with_refresh(self, full_path, string_to_sign, body_str, use_token):
+        data = self._send(full_path, string_to_sign, body_str, use_token)
 
-        if use_token and self.access_token:
-            message = self.access_id + self.access_token + t + nonce + string_to_sign
-        else:
-            message = self.access_id + t + nonce + string_to_sign
-
-        sign = hmac.new(self.access_key.encode('utf-8'),
-                        msg=message.encode('utf-8'),
-                        digestmod=hashlib.sha256).hexdigest().upper()
-
-        headers = {
-            'client_id': self.access_id,
-            'sign': sign,
-            't': t,
-            'nonce': nonce,
-            'sign_method': 'HMAC-SHA256',
-        }
-        if use_token and self.access_token:
-            headers['access_token'] = self.access_token
+        # Auto-refresh once on 1010; _send re-signs with the new token
+        if use_token and isinstance(data, dict) and data.get('code') == 1010:
+            self.log("Token invalid; refreshing…")
+            c = self.connect()
+            if isinstance(c, dict) and c.get('success'):
+                return self._send(full_path, string_to_sign, body_str, use_token)
+
+        return data
+
+    def _send(self, full_path, string_to_sign, body_str, use_token):
+        t = str(time.time_ns() // 1_000_000)
+        nonce = os.urandom(16).hex()
+
+        message_b = b''.join([
+            self._access_id_b,
+            self.access_token.encode('utf-8') if (use_token and self.access_token) else b'',
+            t.encode('ascii'),
+            nonce.encode('ascii'),
+            string_to_sign.encode('utf-8'),
+        ])
+
+        inner = self._inner.copy()
+        inner.update(message_b)
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        sign = outer.hexdigest().upper()
+
+        headers = (self._hdr_tmpl_auth if use_token else self._hdr_tmpl).copy()
+        headers['sign'] = sign
+        headers['t'] = t
+        headers['nonce'] = nonce
         if body_str:
             headers['Content-Type'] = 'application/json'
 
         url = self.base_url + full_path
         try:
-            resp = requests.get(url, headers=headers, timeout=15)
+            resp = self._session.get(url, headers=headers, timeout=15)
         except Exception as e:
             return {'success': False, 'code': 0, 'msg': f'HTTP error: {e}'}
 
         try:
-            data = resp.json()
+            data = orjson.loads(resp.content) if orjson is not None else resp.json()
         except Exception:
             data = {'success': False, 'code': resp.status_code, 'msg': 'non-json', 'text': resp.text}
-
-        # Auto-refresh once on 1010
-        if use_token and isinstance(data, dict) and data.get('code') == 1010 and retry:
-            self.log("Token invalid; refreshing…")
-            c = self.connect()
-            if isinstance(c, dict) and c.get('success'):
-                return self._request(method, path, params=params, body=body, use_token=True, retry=False)
-
         return data
 
 # ---------- Env/config ----------
@@ -112,8 +172,16 @@ MQTT_USER      = os.environ.get("MQTT_USER","")
 MQTT_PASSWORD  = os.environ.get("MQTT_PASSWORD","")
 DPS_ACTIVE     = os.environ.get("DPS_ACTIVE")    # not used for v2 codes but kept for compatibility
 DPS_BATTERY    = os.environ.get("DPS_BATTERY")
+DEBUG          = os.environ.get("DEBUG","0") == "1"
+PUSH_EVENTS    = os.environ.get("PUSH_EVENTS","0") == "1"
+MAX_POLL_INTERVAL = int(os.environ.get("MAX_POLL_INTERVAL", POLL_INTERVAL))  # == POLL_INTERVAL → no back-off
 
 OFFLINE_AFTER  = 300  # seconds without a successful API read → mark entities unavailable
+# Back-off ceiling: kept below OFFLINE_AFTER so one failed read can't flip availability,
+# but never below POLL_INTERVAL so back-off can't make polling faster
+MAX_POLL_INTERVAL = max(POLL_INTERVAL, min(MAX_POLL_INTERVAL, OFFLINE_AFTER // 2))
+TRACEBACK_EVERY = 60  # at most one full traceback per this many seconds; otherwise a one-line summary
+PUSH_POLL_INTERVAL = 120  # fallback poll (seconds) once push events are arriving; below OFFLINE_AFTER
 
 REGION_HOSTS = {
     "eu": "https://openapi.tuyaeu.com",
@@ -123,6 +191,15 @@ REGION_HOSTS = {
 }
 BASE_URL = REGION_HOSTS.get(REGION, REGION_HOSTS["eu"])
 
+# Tuya message service (Pulsar over websocket); requires "Message Service" on the cloud project
+PULSAR_ENDPOINTS = {
+    "eu": "wss://mqe.tuyaeu.com:8285/",
+    "us": "wss://mqe.tuyaus.com:8285/",
+    "cn": "wss://mqe.tuyacn.com:8285/",
+    "in": "wss://mqe.tuyain.com:8285/",
+}
+PULSAR_TOPIC = "event"
+
 def log(msg: str):
     ts = time.strftime("[%Y-%m-%d %H:%M:%S]")
     print(f"{ts} {msg}", flush=True)
@@ -132,11 +209,25 @@ AVAIL_TOPIC = f"tuya/{ENTITY_ID}/availability"
 STATE_TOPIC = f"tuya/{ENTITY_ID}/state"
 BATT_TOPIC  = f"tuya/{ENTITY_ID}/battery"
 
-def mqtt_connect():
+def mqtt_connect(retained):
+    """
+    Connect and start the network loop. On every (re)connect, discovery and the
+    last payload of each topic in `retained` are republished, so state survives
+    a broker that lost its retained store.
+    """
+    import paho.mqtt.client as paho  # deferred until the bridge actually connects
     client = paho.Client(client_id=f"tuya-bridge-{ENTITY_ID}", clean_session=True)
     if MQTT_USER:
         client.username_pw_set(MQTT_USER, MQTT_PASSWORD or None)
     client.will_set(AVAIL_TOPIC, "offline", retain=True)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            publish_discovery(client)
+            for topic, payload in list(retained.items()):
+                client.publish(topic, payload, qos=0, retain=True)
+
+    client.on_connect = on_connect
     client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
     client.loop_start()
     log(f"Connecting to MQTT broker at {MQTT_HOST}:{MQTT_PORT}…")
@@ -170,8 +261,9 @@ def publish_discovery(mqtt):
 
 # ---------- v2 shadow fetch ----------
 def fetch_shadow_v2(api: TuyaOpenAPI):
-    sh = api.get(f"/v2.0/cloud/thing/{DEVICE_ID}/shadow/properties")
-    log(f"OpenAPI v2 shadow response: {json.dumps(sh, ensure_ascii=False)}")
+    sh = api.fetch_shadow(DEVICE_ID)
+    if DEBUG:
+        log(f"OpenAPI v2 shadow response: {json.dumps(sh, ensure_ascii=False)}")
     if isinstance(sh, dict) and sh.get("success"):
         props = sh.get("result", {}).get("properties", [])
         by_code = {}
@@ -186,11 +278,53 @@ def fetch_shadow_v2(api: TuyaOpenAPI):
             return by_code
     return {}
 
+# ---------- push events (Tuya message service) ----------
+def start_push_listener():
+    """
+    Subscribe to Tuya's message service in a background thread.
+    Returns (pulsar, events) where events is a queue of {code: value} deltas
+    for DEVICE_ID, or (None, None) if the subscription can't be started.
+    """
+    try:
+        from tuya_connector import TuyaOpenPulsar
+    except ImportError:
+        log("Push events enabled but tuya-connector-python is not installed; polling only.")
+        return None, None
+
+    events = queue.Queue()
+
+    def on_message(msg):
+        try:
+            data = json.loads(msg) if isinstance(msg, (str, bytes)) else msg
+            if not isinstance(data, dict) or data.get("devId") != DEVICE_ID:
+                return
+            status = data.get("status")
+            if isinstance(status, list):
+                delta = {i.get("code"): i.get("value") for i in status if i.get("code") is not None}
+                if delta:
+                    events.put(delta)
+        except Exception as e:
+            log(f"[PUSH] Could not decode message: {e}")
+
+    pulsar = TuyaOpenPulsar(ACCESS_ID, ACCESS_KEY,
+                            PULSAR_ENDPOINTS.get(REGION, PULSAR_ENDPOINTS["eu"]), PULSAR_TOPIC)
+    pulsar.add_message_listener(on_message)
+    pulsar.start()
+    log("Subscribing to Tuya push events; polling continues at the normal rate until the first event arrives.")
+    return pulsar, events
+
 # ---------- value pickers ----------
+# Prefer explicit door/contact codes; fall back to common names
+_BOOL_KEYS = ("doorcontact_state","contact_state","contact","door","open","switch_1","switch")
+_BOOL_KEYS_SET = frozenset(_BOOL_KEYS)
+_BATT_STATE_MAP = {"low": 20, "middle": 60, "medium": 60, "high": 100}
+
 def pick_boolean(by_code):
-    # Prefer explicit door/contact codes; fall back to common names
-    for k in ["doorcontact_state","contact_state","contact","door","open","switch_1","switch"]:
-        if k in by_code and isinstance(by_code[k], (bool, int)):
+    hits = _BOOL_KEYS_SET & by_code.keys()
+    if not hits:
+        return None
+    for k in _BOOL_KEYS:
+        if k in hits and isinstance(by_code[k], (bool, int)):
             return bool(by_code[k])
     return None
 
@@ -200,13 +334,13 @@ def pick_battery(by_code):
     if "battery" in by_code and isinstance(by_code["battery"], (int,float)):
         return int(by_code["battery"])
     if "battery_state" in by_code and isinstance(by_code["battery_state"], str):
-        m = {"low": 20, "middle": 60, "medium": 60, "high": 100}
-        return m.get(by_code["battery_state"].strip().lower())
+        return _BATT_STATE_MAP.get(by_code["battery_state"].strip().lower())
     return None
 
 # ---------- main ----------
 def main():
-    log(f"Starting Tuya Cloud → MQTT bridge for device {DEVICE_ID} ({NAME}), polling every {POLL_INTERVAL}s.")
+    backoff = f" (up to {MAX_POLL_INTERVAL}s while idle)" if MAX_POLL_INTERVAL > POLL_INTERVAL else ""
+    log(f"Starting Tuya Cloud → MQTT bridge for device {DEVICE_ID} ({NAME}), polling every {POLL_INTERVAL}s{backoff}.")
     log("Configuration:")
     log(f"  Region: {REGION}")
     log(f"  Base URL: {BASE_URL}")
@@ -216,10 +350,17 @@ def main():
     log(f"  Access ID: {ACCESS_ID[:8]}***")
     log(f"  Device ID: {DEVICE_ID}")
 
-    mqtt = mqtt_connect()
-    publish_discovery(mqtt)
+    # Turn the supervisor's SIGTERM into SystemExit so cleanup below runs
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    # Last published payload per topic, replayed by the MQTT thread on (re)connect.
     # Start as online; will flip to offline if no success for > OFFLINE_AFTER
-    mqtt.publish(AVAIL_TOPIC, "online", retain=True)
+    retained = {AVAIL_TOPIC: "online"}
+    mqtt = mqtt_connect(retained)
+
+    def publish_retained(topic, payload):
+        retained[topic] = payload
+        mqtt.publish(topic, payload, qos=0, retain=True)
 
     api = TuyaOpenAPI(BASE_URL, ACCESS_ID, ACCESS_KEY, logger=log)
     log(f"Connecting Tuya OpenAPI at {BASE_URL} with schema={APP_SCHEMA}, country={COUNTRY_CODE} …")
@@ -229,46 +370,117 @@ def main():
     except Exception as e:
         log(f"OpenAPI connect exception: {e}")
 
+    pulsar, events = start_push_listener() if PUSH_EVENTS else (None, None)
+    push_live = False  # set once a push event has actually been received
+    base_interval = POLL_INTERVAL
+
     last_ok = time.time()  # track last successful API read
     avail_state = "online"
+    last_state = None  # last published payloads; only republish on change
+    last_batt = None
+    current_interval = base_interval  # backs off while readings stay unchanged
+    unchanged_count = 0
+    last_tb_time = 0
+    known = {}      # last full shadow, patched by push deltas
+    pending = None  # push delta received while waiting
+    next_poll = 0   # deadline for the next API read; push deltas don't postpone it
 
-    while True:
-        try:
-            by_code = fetch_shadow_v2(api)
-            if by_code:
-                # got data → ensure availability is online
-                now = time.time()
-                last_ok = now
-                if avail_state != "online":
-                    mqtt.publish(AVAIL_TOPIC, "online", retain=True)
-                    avail_state = "online"
-                    log("Availability → online (API read succeeded).")
-
-                onoff = pick_boolean(by_code)
-                batt  = pick_battery(by_code)
-
-                if onoff is not None:
-                    mqtt.publish(STATE_TOPIC, "ON" if onoff else "OFF", retain=True)
-                    log(f"State updated (openapi-v2): {'ON' if onoff else 'OFF'}")
+    try:
+        while True:
+            msgs = []  # collected per cycle and written as one line
+            polled = pending is None
+            try:
+                if pulsar is not None and not pulsar.is_alive():
+                    # listener thread gone: no more events will arrive, so poll normally again
+                    pulsar = None
+                    push_live = False
+                    base_interval = current_interval = POLL_INTERVAL
+                    unchanged_count = 0
+                    next_poll = min(next_poll, time.time() + POLL_INTERVAL)
+                    msgs.append(f"Push event listener stopped; polling every {POLL_INTERVAL}s.")
+
+                if pending is not None:
+                    if not push_live:
+                        # subscription proven working: drop to the slow fallback poll
+                        push_live = True
+                        base_interval = max(POLL_INTERVAL, PUSH_POLL_INTERVAL)
+                        msgs.append(f"Push events active; fallback polling every {base_interval}s.")
+                    known.update(pending)
+                    by_code, source = dict(known), "push"
                 else:
-                    log("State key not found in v2 shadow (will retry).")
-
-                if batt is not None:
-                    mqtt.publish(BATT_TOPIC, str(batt), retain=True)
-                    log(f"Battery updated (openapi-v2): {batt}%")
+                    by_code, source = fetch_shadow_v2(api), "openapi-v2"
+                    if by_code:
+                        known = dict(by_code)
+                if by_code:
+                    # availability tracks API health, so only a successful read counts
+                    if source == "openapi-v2":
+                        last_ok = time.time()
+                    if source == "openapi-v2" and avail_state != "online":
+                        publish_retained(AVAIL_TOPIC, "online")
+                        avail_state = "online"
+                        msgs.append("Availability → online (API read succeeded).")
+
+                    onoff = pick_boolean(by_code)
+                    batt  = pick_battery(by_code)
+                    changed = False
+
+                    if onoff is not None:
+                        state = "ON" if onoff else "OFF"
+                        if state != last_state:
+                            publish_retained(STATE_TOPIC, state)
+                            last_state = state
+                            changed = True
+                            msgs.append(f"State updated ({source}): {state}")
+                    else:
+                        msgs.append(f"State key not found in {source} data (will retry).")
+
+                    if batt is not None and batt != last_batt:
+                        publish_retained(BATT_TOPIC, str(batt))
+                        last_batt = batt
+                        changed = True
+                        msgs.append(f"Battery updated ({source}): {batt}%")
+
+                    if changed or push_live:
+                        # with push events the fallback poll stays fixed; no back-off
+                        unchanged_count = 0
+                        current_interval = base_interval
+                    else:
+                        unchanged_count += 1
+                        current_interval = min(base_interval * 2 ** min(unchanged_count // 3, 4), MAX_POLL_INTERVAL)
+                else:
+                    # keep base cadence while reads fail so the offline timeout stays accurate
+                    unchanged_count = 0
+                    current_interval = base_interval
+                    # No data — check availability timeout
+                    if time.time() - last_ok > OFFLINE_AFTER and avail_state != "offline":
+                        publish_retained(AVAIL_TOPIC, "offline")
+                        avail_state = "offline"
+                        msgs.append(f"No successful API read for > {OFFLINE_AFTER}s → Availability → offline.")
+
+            except Exception as e:
+                msgs.append(f"[ERROR] {type(e).__name__}: {e}")
+                if time.time() - last_tb_time > TRACEBACK_EVERY:
+                    last_tb_time = time.time()
+                    msgs.append(f"[TRACEBACK] {traceback.format_exc()}")
+
+            if msgs:
+                log(" | ".join(msgs))
+
+            if polled:
+                next_poll = time.time() + current_interval
+
+            if events is None:
+                time.sleep(current_interval)
             else:
-                # No data — check availability timeout
-                if time.time() - last_ok > OFFLINE_AFTER and avail_state != "offline":
-                    mqtt.publish(AVAIL_TOPIC, "offline", retain=True)
-                    avail_state = "offline"
-                    log(f"No successful API read for > {OFFLINE_AFTER}s → Availability → offline.")
-
-        except Exception as e:
-            log(f"[ERROR] {e}")
-            import traceback
-            log(f"[TRACEBACK] {traceback.format_exc()}")
-
-        time.sleep(POLL_INTERVAL)
+                # wake early on a push delta; otherwise fall through to a fallback poll
+                try:
+                    pending = events.get(timeout=max(0, next_poll - time.time()))
+                except queue.Empty:
+                    pending = None
+    finally:
+        if pulsar is not None:
+            pulsar.stop()
+        api.close()
 
 if __name__ == "__main__":
     main()
@@ -15,14 +15,17 @@ ENTITY_ID=$(jq -r '.entity_id // "tuya_sensor"' "$OPTS")
 NAME=$(jq -r '.name // "Tuya Sensor"' "$OPTS")
 DEVICE_CLASS=$(jq -r '.device_class // "motion"' "$OPTS")
 POLL_INTERVAL=$(jq -r '.poll_interval // 20' "$OPTS")
+MAX_POLL_INTERVAL=$(jq -r '.max_poll_interval // .poll_interval // 20' "$OPTS")
 MQTT_HOST=$(jq -r '.mqtt_host // "core-mosquitto"' "$OPTS")
 MQTT_PORT=$(jq -r '.mqtt_port // 1883' "$OPTS")
 MQTT_USER=$(jq -r '.mqtt_user // ""' "$OPTS")
 MQTT_PASSWORD=$(jq -r '.mqtt_password // ""' "$OPTS")
 DPS_ACTIVE=$(jq -r '.dps_active // empty' "$OPTS")
 DPS_BATTERY=$(jq -r '.dps_battery // empty' "$OPTS")
+DEBUG=$(jq -r 'if .debug then "1" else "0" end' "$OPTS")
+PUSH_EVENTS=$(jq -r 'if .push_events then "1" else "0" end' "$OPTS")
 
-export ACCESS_ID ACCESS_KEY REGION USERNAME PASSWORD COUNTRY_CODE APP_SCHEMA DEVICE_ID ENTITY_ID NAME DEVICE_CLASS POLL_INTERVAL MQTT_HOST MQTT_PORT MQTT_USER MQTT_PASSWORD
+export ACCESS_ID ACCESS_KEY REGION USERNAME PASSWORD COUNTRY_CODE APP_SCHEMA DEVICE_ID ENTITY_ID NAME DEVICE_CLASS POLL_INTERVAL MAX_POLL_INTERVAL MQTT_HOST MQTT_PORT MQTT_USER MQTT_PASSWORD DEBUG PUSH_EVENTS
 
 if [ -n "${DPS_ACTIVE:-}" ]; then export DPS_ACTIVE; fi
 if [ -n "${DPS_BATTERY:-}" ]; then export DPS_BATTERY; fi
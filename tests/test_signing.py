@@ -0,0 +1,50 @@
+import hashlib
+import hmac
+import os
+import sys
+import unittest
+
+# bridge.py reads its config from the environment at import time
+os.environ.setdefault("ACCESS_ID", "test-id")
+os.environ.setdefault("ACCESS_KEY", "test-key")
+os.environ.setdefault("DEVICE_ID", "test-device")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import bridge  # noqa: E402
+
+
+def sign(states, msg):
+    # mirrors TuyaOpenAPI._send: copy the keyed states, never mutate them
+    inner, outer = states
+    inner = inner.copy()
+    inner.update(msg)
+    outer = outer.copy()
+    outer.update(inner.digest())
+    return outer.hexdigest()
+
+
+class HmacStatesTest(unittest.TestCase):
+    MSG = b"client_id" + b"token" + b"1700000000000" + b"nonce" + b"GET\n...\n\n/v1.0/token?grant_type=1"
+
+    def test_matches_stdlib_hmac(self):
+        keys = {
+            "short": b"k",
+            "empty": b"",
+            "32 bytes": b"a" * 32,
+            "block size": b"b" * 64,
+            "long (hashed first)": b"c" * 100,
+            "non-ascii": "clé-ß".encode("utf-8"),
+        }
+        for name, key in keys.items():
+            with self.subTest(key=name):
+                self.assertEqual(sign(bridge._hmac_sha256_states(key), self.MSG), hmac.new(key, self.MSG, hashlib.sha256).hexdigest())
+
+    def test_states_are_reusable(self):
+        key = b"d" * 100
+        states = bridge._hmac_sha256_states(key)
+        for msg in (self.MSG, b"other", self.MSG):
+            self.assertEqual(sign(states, msg), hmac.new(key, msg, hashlib.sha256).hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()